@@ -1,150 +1,605 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Request, current_app, request, jsonify, Response
 import os
-import datetime
-import random
-import string
-import shutil  # Added to fix 'name shutil is not defined'
+try:
+    import fcntl
+except ImportError:  # Windows, where only the development server runs
+    fcntl = None
+import mmap
+import time
+import secrets
+import shutil
+import tempfile
+import threading
+import uuid
 from PIL import Image
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import HTTPException
 from werkzeug.utils import secure_filename
 import logging
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 import base64
 import json
+from concurrent.futures import ThreadPoolExecutor
+
+class UploadRequest(Request):
+    """Request that keeps each uploaded file in memory up to UPLOAD_SPOOL_SIZE before spilling to disk."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Werkzeug's default spills anything over 500 KB to a temp file, which
+        # is most phone photos
+        return tempfile.SpooledTemporaryFile(max_size=current_app.config['UPLOAD_SPOOL_SIZE'], mode='rb+')
 
 app = Flask(__name__)
+app.request_class = UploadRequest
+# Caps the whole request, so a batch upload is limited to this many MB in
+# total across all its files, not per file; raise MAX_UPLOAD_MB for larger batches
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_UPLOAD_MB', '100')) * 1024 * 1024
+# Each uploaded file stays in memory up to this size. A batch of files that
+# are each under it can keep a whole request, up to MAX_CONTENT_LENGTH, in
+# memory, so the worst case is MAX_CONTENT_LENGTH per concurrent request
+# (2 workers x 8 threads in the Dockerfile). Lower it to trade memory for disk.
+app.config['UPLOAD_SPOOL_SIZE'] = int(os.getenv('UPLOAD_SPOOL_MB', '8')) * 1024 * 1024
 app.config['UPLOAD_FOLDER'] = '/tmp/images'  # Use /tmp for Vercel
-app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif'}
+app.config['FAILED_FOLDER'] = '/tmp/images/failed'  # Images that repeatedly failed to push
+app.config['PUSH_LOCK_FILE'] = '/tmp/images-push.lock'  # Serializes pushes across worker processes
+app.config['PUSH_JOBS_FOLDER'] = '/tmp/push-jobs'  # Status of background pushes, shared by all workers
+app.config['VERIFY_IMAGES'] = os.getenv('VERIFY_IMAGES') == '1'  # Also fully check uploads with PIL
+ALLOWED_EXTENSIONS = frozenset({'png', 'jpg', 'jpeg', 'gif'})
+app.config['ALLOWED_EXTENSIONS'] = ALLOWED_EXTENSIONS
+# Leading magic bytes of each allowed format, and the extensions it may be uploaded with
+IMAGE_SIGNATURES = {
+    b'\x89PNG\r\n\x1a\n': ('png',),
+    b'\xff\xd8\xff': ('jpg', 'jpeg'),
+    b'GIF87a': ('gif',),
+    b'GIF89a': ('gif',),
+}
+IMAGE_FORMATS = ('PNG', 'JPEG', 'GIF')  # PIL plugins tried when verifying uploads
 
 # GitHub configuration (use environment variables for Vercel)
 GITHUB_PAT = os.getenv('GITHUB_PAT', 'your-personal-access-token')  # Set in Vercel dashboard
 GITHUB_REPO = 'NitinBot001/EasyFarms_assets' # e.g., 'your-username/your-repo'
-GITHUB_API_URL = f"https://api.github.com/repos/{GITHUB_REPO}/contents"
+GITHUB_BRANCH = 'main'
+GITHUB_API_URL = f"https://api.github.com/repos/{GITHUB_REPO}/git"
+PUSH_WORKERS = 8  # Concurrent blob uploads during a push
+
+GITHUB_TIMEOUT = (5, 60)  # (connect, read) seconds for every GitHub call
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that applies GITHUB_TIMEOUT to requests made without a timeout."""
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = GITHUB_TIMEOUT
+        return super().send(request, **kwargs)
+
+# One session for all GitHub calls so connections and TLS are reused
+# across files and across pushes. Every request is safe to repeat (blobs,
+# trees and commits are content-addressed, and the ref update sets an
+# explicit SHA), so transient errors are retried for all methods. Retries
+# only fire on errors, so every call also gets a timeout; otherwise a
+# stalled connection would hang the push, and the push locks, forever.
+GITHUB_SESSION = requests.Session()
+GITHUB_SESSION.mount("https://", TimeoutHTTPAdapter(
+    pool_maxsize=PUSH_WORKERS,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "POST", "PATCH"}),
+        raise_on_status=False  # Hand the last response back so callers can handle it per file
+    )
+))
+GITHUB_SESSION.headers.update({
+    "Authorization": f"token {GITHUB_PAT}",
+    "Accept": "application/vnd.github.v3+json"
+})
+
+# Held while a push runs, so overlapping triggers don't upload the same files twice
+PUSH_LOCK = threading.Lock()
+
+# (commit SHA, tree SHA) of the last commit this process pushed; only
+# touched while PUSH_LOCK is held
+last_pushed_commit = (None, None)
+
+# Rejected pushes after which an image is moved to FAILED_FOLDER. The count
+# is kept on disk next to the image, in "<image>.failures", so all workers
+# share it and it survives restarts; only touched while the push locks are held
+MAX_PUSH_ATTEMPTS = 3
+
+# Temporary .part files older than this were left behind by an upload that
+# died mid-write, and are removed the next time a push lists the folder
+PART_FILE_MAX_AGE = 60 * 60
+
+# Background pushes run one at a time on a single thread. Note that on
+# serverless hosts such as Vercel, work left running after the response
+# may be frozen, so background pushes are only started on request.
+PUSH_EXECUTOR = ThreadPoolExecutor(max_workers=1)
+
+# Id of the background push waiting to start, if any; later requests join
+# it instead of queueing another push behind it
+JOB_LOCK = threading.Lock()
+queued_job_id = None
+
+# How long a background push waits for a running push before giving up
+PUSH_WAIT_TIMEOUT = 10 * 60
+
+# Job status files are pruned once this old, and a job still marked as
+# running after this long is reported as lost
+PUSH_JOB_TTL = 24 * 60 * 60
+
+# Uploads since the last automatic push; AUTO_PUSH_THRESHOLD of 0 disables it
+AUTO_PUSH_THRESHOLD = int(os.getenv('AUTO_PUSH_THRESHOLD', '0'))
+PENDING_LOCK = threading.Lock()
+pending_uploads = 0
+
+# Shared pool for saving the files of a batch upload in parallel
+UPLOAD_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.getenv('UPLOAD_WORKERS', '8')))
+
+# The upload page has no template logic, so serve it as static bytes
+with open(os.path.join(app.root_path, 'templates', 'upload.html'), 'rb') as f:
+    UPLOAD_PAGE_HTML = f.read()
+
+# (epoch second, formatted timestamp) shared by uploads within the same second
+timestamp_cache = (0, '')
+
+# Create the images directory once instead of checking on every upload
+os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['PUSH_JOBS_FOLDER'], exist_ok=True)
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def classify_file(filename):
+    """Return whether the file extension is allowed, and the lowercased extension without the dot."""
+    i = filename.rfind('.')
+    extension = filename[i + 1:].lower() if i > 0 else ''
+    return extension in ALLOWED_EXTENSIONS, extension
+
 def allowed_file(filename):
     """Check if the file extension is allowed."""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+    return classify_file(filename)[0]
 
 def generate_random_code():
-    """Generate a 4-digit random code."""
-    return ''.join(random.choices(string.digits, k=4))
-
-def rename_and_save_image(file):
-    """Rename and save the image with the specified format."""
-    # Create images directory if it doesn't exist
-    if not os.path.exists(app.config['UPLOAD_FOLDER']):
-        os.makedirs(app.config['UPLOAD_FOLDER'])
-    
-    # Get current timestamp
-    now = datetime.datetime.now()
-    timestamp = now.strftime("%d_%m_%y_%H_%M_%S")
-    
-    # Generate random 4-digit code
-    random_code = generate_random_code()
-    
-    # Get file extension
-    file_extension = os.path.splitext(file.filename)[1].lower()
-    
-    # Create new filename
-    new_filename = f"{timestamp}_{random_code}{file_extension}"
-    destination_path = os.path.join(app.config['UPLOAD_FOLDER'], new_filename)
+    """Generate a 4-character random hex code."""
+    return f"{secrets.randbits(16):04x}"
+
+def get_timestamp():
+    """Return the current time formatted for filenames, formatting at most once per second."""
+    global timestamp_cache
+    now = int(time.time())
+    cached = timestamp_cache
+    if cached[0] != now:
+        cached = (now, time.strftime("%d_%m_%y_%H_%M_%S", time.localtime(now)))
+        timestamp_cache = cached
+    return cached[1]
+
+def new_image_path(file_extension):
+    """Return a fresh timestamped filename and its path in the upload folder."""
+    # Timestamp plus a random 4-character code
+    new_filename = f"{get_timestamp()}_{generate_random_code()}.{file_extension}"
+    return new_filename, os.path.join(app.config['UPLOAD_FOLDER'], new_filename)
+
+def rename_and_save_image(file, file_extension):
+    """Rename and save the image with the specified format, given its already-checked extension."""
+    # Set once this call has created its temporary file, so cleanup never
+    # removes a file that belongs to another upload
+    temp_path = None
     
     try:
-        # Verify if it's a valid image
-        img = Image.open(file)
-        img.verify()  # Verify it's an image
-        file.seek(0)  # Reset file pointer after verification
+        # Check the leading magic bytes against the extension instead of
+        # parsing the whole image; they are written out below rather than
+        # rewinding, so non-seekable request streams work too
+        head = file.stream.read(8)
+        if not any(head.startswith(signature) and file_extension in extensions
+                   for signature, extensions in IMAGE_SIGNATURES.items()):
+            raise ValueError(f"content is not a valid .{file_extension} image")
+        
+        # Write under a temporary name first, so a push never picks up a file
+        # that is still being written or hasn't been verified yet. Random
+        # codes can collide within the same second, so the file is created
+        # exclusively and a new name is picked if it is taken. The directory
+        # is created at startup and only needs recreating if something
+        # removed it.
+        while True:
+            new_filename, destination_path = new_image_path(file_extension)
+            try:
+                f = open(f"{destination_path}.part", 'xb')
+            except FileExistsError:
+                continue
+            except FileNotFoundError:
+                os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+                continue
+            temp_path = f"{destination_path}.part"
+            break
+        
+        # Stream the upload straight to disk in 1 MiB chunks, so the whole
+        # upload is never held in memory
+        with f:
+            f.write(head)
+            shutil.copyfileobj(file.stream, f, length=1 << 20)
         
-        # Save the image
-        file.save(destination_path)
+        if app.config['VERIFY_IMAGES']:
+            with Image.open(temp_path, formats=IMAGE_FORMATS) as img:
+                img.verify()  # Verify it's an image
+        
+        # Unlike os.replace, os.link fails instead of overwriting an image
+        # saved under the same name in the meantime
+        while True:
+            try:
+                os.link(temp_path, destination_path)
+                break
+            except FileExistsError:
+                new_filename, destination_path = new_image_path(file_extension)
+        os.remove(temp_path)
         return new_filename
+    except HTTPException:
+        # Oversized or aborted request bodies surface while streaming; let
+        # them reach their error handlers instead of reporting a bad image
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
     except Exception as e:
-        logger.error(f"Error processing image {file.filename}: {str(e)}")
+        logger.error("Error processing image %s: %s", file.filename, e)
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
         return None
 
-def push_images_to_github():
-    """Check images directory and push to GitHub using REST API, then clear the directory."""
+def process_file(file):
+    """Validate and save one uploaded file, returning its result entry."""
+    try:
+        allowed, file_extension = classify_file(file.filename)
+        if allowed:
+            new_filename = rename_and_save_image(file, file_extension)
+            if new_filename:
+                count_pending_upload()
+                return {
+                    'filename': file.filename,
+                    'url' : f'https://easyfarms-assets.pages.dev/images/{new_filename}',
+                    'new_filename': new_filename,
+                    'status': 'success',
+                    'message': f'Image saved as: {new_filename}'
+                }
+            else:
+                return {
+                    'filename': file.filename,
+                    'status': 'error',
+                    'message': 'Error processing image. Invalid or corrupted file.'
+                }
+        else:
+            return {
+                'filename': file.filename,
+                'status': 'error',
+                'message': 'Invalid file format. Allowed formats: png, jpg, jpeg, gif'
+            }
+    finally:
+        # Release the upload's spooled buffer now instead of at the end of
+        # the request, which matters for long batches
+        file.close()
+
+def process_upload(file):
+    """Handle a single-image upload, returning the response body and status code."""
+    if file.filename == '':
+        return {
+            'status': 'error',
+            'message': 'No file selected'
+        }, 400
+    
+    result = process_file(file)
+    if result['status'] == 'success':
+        return {
+            'status': 'success',
+            'url' : result['url'],
+            'message': f"Image uploaded and saved as: {result['new_filename']}",
+            'filename': result['new_filename']
+        }, 200
+    else:
+        return {
+            'status': 'error',
+            'message': result['message']
+        }, 400
+
+def process_files(files):
+    """Handle a batch upload, returning the response body and status code."""
+    if not files or all(file.filename == '' for file in files):
+        return {
+            'status': 'error',
+            'message': 'No files selected'
+        }, 400
+    
+    # Verify and save the files in parallel; the work is dominated by
+    # reading the upload streams and writing to disk
+    results = list(UPLOAD_EXECUTOR.map(process_file, files))
+    
+    if all(result['status'] == 'error' for result in results):
+        return {
+            'status': 'error',
+            'message': 'All uploads failed',
+            'results': results
+        }, 400
+    
+    status_code = 200 if any(result['status'] == 'success' for result in results) else 400
+    return {
+        'status': 'success' if status_code == 200 else 'partial_success',
+        'message': 'Batch upload processed',
+        'results': results
+    }, status_code
+
+def read_image_content(image_path):
+    """Read an image from disk and return its base64-encoded content."""
+    with open(image_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ''  # mmap can't map an empty file
+        # Encode straight from the page cache instead of copying the file
+        # into a bytes object first
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return base64.b64encode(mm).decode('ascii')
+
+def create_blob(image_path):
+    """Upload an image as a git blob.
+
+    Returns (sha, None) on success, or (None, rejected) on failure, where
+    rejected is True when GitHub refused the file itself rather than being
+    unavailable or refusing our credentials.
+    """
+    try:
+        response = GITHUB_SESSION.post(
+            f"{GITHUB_API_URL}/blobs",
+            data=json.dumps({
+                "content": read_image_content(image_path),
+                "encoding": "base64"
+            })
+        )
+    except requests.RequestException as e:
+        logger.error("Failed to upload %s: %s", image_path, e)
+        return None, False
+    if response.status_code != 201:
+        logger.error("Failed to upload %s: HTTP %d", image_path, response.status_code)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("GitHub response for %s: %s", image_path, response.text)
+        # 5xx, rate limits and auth errors would fail any file equally
+        return None, 400 <= response.status_code < 500 and response.status_code not in (401, 403, 429)
+    return response.json()["sha"], None
+
+def record_push_failure(image_file, image_path):
+    """Count a rejected push of an image, moving it to the failed folder once it reaches MAX_PUSH_ATTEMPTS."""
+    count_path = f"{image_path}.failures"
+    try:
+        with open(count_path) as f:
+            failures = int(f.read()) + 1
+    except (FileNotFoundError, ValueError):
+        failures = 1
+    if failures < MAX_PUSH_ATTEMPTS:
+        with open(count_path, 'w') as f:
+            f.write(str(failures))
+        return
+    os.makedirs(app.config['FAILED_FOLDER'], exist_ok=True)
+    os.replace(image_path, os.path.join(app.config['FAILED_FOLDER'], image_file))
+    if os.path.exists(count_path):
+        os.remove(count_path)
+    logger.warning("Moved %s to the failed folder after %d rejected pushes.", image_file, MAX_PUSH_ATTEMPTS)
+
+def commit_tree(tree, message):
+    """Commit tree entries on top of the branch head and move the branch to the new commit."""
+    global last_pushed_commit
+    ref_response = GITHUB_SESSION.get(f"{GITHUB_API_URL}/ref/heads/{GITHUB_BRANCH}")
+    ref_response.raise_for_status()
+    head_sha = ref_response.json()["object"]["sha"]
+
+    # Skip looking up the base tree when the branch is still at our last commit
+    if last_pushed_commit[0] == head_sha:
+        base_tree_sha = last_pushed_commit[1]
+    else:
+        commit_response = GITHUB_SESSION.get(f"{GITHUB_API_URL}/commits/{head_sha}")
+        commit_response.raise_for_status()
+        base_tree_sha = commit_response.json()["tree"]["sha"]
+
+    # Entries for paths that already exist replace them, so creates and
+    # updates need no separate existence check
+    tree_response = GITHUB_SESSION.post(
+        f"{GITHUB_API_URL}/trees",
+        data=json.dumps({"base_tree": base_tree_sha, "tree": tree})
+    )
+    tree_response.raise_for_status()
+    new_tree_sha = tree_response.json()["sha"]
+
+    new_commit_response = GITHUB_SESSION.post(
+        f"{GITHUB_API_URL}/commits",
+        data=json.dumps({
+            "message": message,
+            "tree": new_tree_sha,
+            "parents": [head_sha]
+        })
+    )
+    new_commit_response.raise_for_status()
+    new_commit_sha = new_commit_response.json()["sha"]
+
+    update_response = GITHUB_SESSION.patch(
+        f"{GITHUB_API_URL}/refs/heads/{GITHUB_BRANCH}",
+        data=json.dumps({"sha": new_commit_sha})
+    )
+    update_response.raise_for_status()
+    last_pushed_commit = (new_commit_sha, new_tree_sha)
+
+def push_images_to_github(wait=0):
+    """Push pending images to GitHub. Give up if another push is still running after wait seconds."""
+    deadline = time.monotonic() + wait
+    if not (PUSH_LOCK.acquire(timeout=wait) if wait else PUSH_LOCK.acquire(blocking=False)):
+        logger.info("Push already in progress.")
+        return False, "A push is already in progress."
+    try:
+        # gunicorn workers share the upload folder, so also lock across
+        # processes. fcntl is missing on Windows, where the single-process
+        # development server only needs PUSH_LOCK.
+        if fcntl is None:
+            return push_pending_images()
+        with open(app.config['PUSH_LOCK_FILE'], 'w') as lock_file:
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        logger.info("Push already in progress in another worker.")
+                        return False, "A push is already in progress."
+                    time.sleep(0.5)
+            return push_pending_images()
+    finally:
+        PUSH_LOCK.release()
+
+def push_pending_images():
+    """Push all images in the upload directory to GitHub as a single commit, then delete them locally."""
     try:
-        # Check if images directory exists and has files
-        if not os.path.exists(app.config['UPLOAD_FOLDER']):
+        # Check if images directory exists and has images; scandir reports the
+        # entry type from the directory listing, so no stat per file is needed.
+        # Anything that isn't an allowed image (dotfiles, temp files) is skipped.
+        try:
+            entries = []
+            failure_counts = set()  # Images with a .failures count beside them
+            part_cutoff = time.time() - PART_FILE_MAX_AGE
+            with os.scandir(app.config['UPLOAD_FOLDER']) as it:
+                for e in it:
+                    if not e.is_file(follow_symlinks=False):
+                        continue
+                    if allowed_file(e.name):
+                        entries.append((e.name, e.path))
+                    elif e.name.endswith('.failures'):
+                        failure_counts.add(e.name[:-len('.failures')])
+                    elif e.name.endswith('.part'):
+                        try:
+                            if e.stat(follow_symlinks=False).st_mtime < part_cutoff:
+                                os.remove(e.path)
+                                logger.info("Removed stale temporary file %s.", e.name)
+                        except FileNotFoundError:
+                            pass  # Published or cleaned up since the listing
+        except FileNotFoundError:
             logger.info("No images directory found.")
             return False, "No images directory found."
         
-        image_files = [f for f in os.listdir(app.config['UPLOAD_FOLDER']) if os.path.isfile(os.path.join(app.config['UPLOAD_FOLDER'], f))]
+        image_files = [name for name, _ in entries]
         if not image_files:
             logger.info("No images to push.")
             return False, "No images to push."
         
-        logger.info(f"Found {len(image_files)} images to push.")
+        logger.info("Found %d images to push.", len(image_files))
 
-        headers = {
-            "Authorization": f"token {GITHUB_PAT}",
-            "Accept": "application/vnd.github.v3+json"
-        }
+        # Blobs are content-addressed and don't touch the branch, so they can
+        # be uploaded concurrently; only the final ref update is serialized
+        image_paths = [path for _, path in entries]
+        with ThreadPoolExecutor(max_workers=PUSH_WORKERS) as executor:
+            results = list(executor.map(create_blob, image_paths))
 
-        # Process each image
-        for image_file in image_files:
-            image_path = os.path.join(app.config['UPLOAD_FOLDER'], image_file)
-            github_path = f"images/{image_file}"
-            
-            # Read and encode image content
-            with open(image_path, 'rb') as f:
-                content = base64.b64encode(f.read()).decode('utf-8')
-            
-            # Check if file exists
-            response = requests.get(
-                f"{GITHUB_API_URL}/{github_path}",
-                headers=headers
-            )
-            
-            payload = {
-                "message": f"Add or update image {image_file}",
-                "content": content,
-                "branch": "main"
-            }
-            
-            if response.status_code == 200:
-                # File exists, update it
-                file_data = response.json()
-                payload["sha"] = file_data["sha"]
-                put_response = requests.put(
-                    f"{GITHUB_API_URL}/{github_path}",
-                    headers=headers,
-                    data=json.dumps(payload)
-                )
-                if put_response.status_code not in (200, 201):
-                    logger.error(f"Failed to update {image_file}: {put_response.text}")
-                    continue
-                logger.info(f"Updated {image_file} in GitHub.")
-            else:
-                # File does not exist, create it
-                put_response = requests.put(
-                    f"{GITHUB_API_URL}/{github_path}",
-                    headers=headers,
-                    data=json.dumps(payload)
-                )
-                if put_response.status_code not in (200, 201):
-                    logger.error(f"Failed to create {image_file}: {put_response.text}")
-                    continue
-                logger.info(f"Created {image_file} in GitHub.")
-        
-        # Check if any images were successfully uploaded
-        if image_files:
-            # Clear the images directory
-            shutil.rmtree(app.config['UPLOAD_FOLDER'])
-            logger.info("Cleared images directory after push.")
-            return True, "Successfully pushed images to GitHub."
-        else:
+        pushed = [(entry, sha) for entry, (sha, _) in zip(entries, results) if sha]
+        failed_files = [image_file for (image_file, _), (sha, _) in zip(entries, results) if not sha]
+
+        # Set aside files GitHub keeps rejecting so every later push doesn't
+        # upload them again; outages and auth errors don't count against them
+        for entry, (_, rejected) in zip(entries, results):
+            if rejected:
+                record_push_failure(*entry)
+
+        if not pushed:
             return False, "No images were successfully pushed."
+
+        tree = [
+            {"path": f"images/{image_file}", "mode": "100644", "type": "blob", "sha": sha}
+            for (image_file, _), sha in pushed
+        ]
+        commit_tree(tree, f"Add or update {len(tree)} images")
+        logger.info("Pushed %d images to GitHub in one commit.", len(tree))
+
+        # Remove only the files that were committed; images uploaded during
+        # the push, or whose blob upload failed, stay for the next push
+        for (image_file, image_path), _ in pushed:
+            os.unlink(image_path)
+            if image_file in failure_counts:
+                os.unlink(f"{image_path}.failures")
+        logger.info("Removed pushed images from the images directory.")
+        if failed_files:
+            return True, (f"Pushed {len(pushed)} images to GitHub; "
+                          f"{len(failed_files)} failed: {', '.join(failed_files)}")
+        return True, "Successfully pushed images to GitHub."
             
     except Exception as e:
-        logger.error(f"Error pushing to GitHub: {str(e)}")
+        logger.error("Error pushing to GitHub: %s", e)
         return False, f"Error pushing to GitHub: {str(e)}"
 
+def save_push_job(job_id, status, message, started):
+    """Record the state of a background push where any worker process can read it."""
+    job_path = os.path.join(app.config['PUSH_JOBS_FOLDER'], f"{job_id}.json")
+    with open(f"{job_path}.tmp", 'w') as f:
+        json.dump({
+            'status': status,
+            'message': message,
+            'pid': os.getpid(),
+            'started': started
+        }, f)
+    os.replace(f"{job_path}.tmp", job_path)
+
+def prune_push_jobs():
+    """Delete job status files that have not been updated within PUSH_JOB_TTL."""
+    cutoff = time.time() - PUSH_JOB_TTL
+    with os.scandir(app.config['PUSH_JOBS_FOLDER']) as it:
+        for entry in it:
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass  # Another worker pruned it first
+
+def push_job_lost(job):
+    """Return True if a job marked as running can no longer finish."""
+    if time.time() - job['started'] > PUSH_JOB_TTL:
+        return True
+    try:
+        os.kill(job['pid'], 0)
+    except ProcessLookupError:
+        return True  # The worker that ran it has exited
+    except PermissionError:
+        pass
+    return False
+
+def run_push_job(job_id, started):
+    """Run a push on the background executor and record its outcome."""
+    global queued_job_id
+    with JOB_LOCK:
+        queued_job_id = None  # Uploads from now on need a new push
+    try:
+        # Wait out any push already running rather than failing, so uploads
+        # that triggered this job are still pushed
+        success, message = push_images_to_github(wait=PUSH_WAIT_TIMEOUT)
+    except Exception as e:
+        success, message = False, f"Error pushing to GitHub: {str(e)}"
+    save_push_job(job_id, 'success' if success else 'error', message, started)
+
+def start_push_job():
+    """Queue a background push and return its job id, reusing a push that hasn't started yet."""
+    global queued_job_id
+    with JOB_LOCK:
+        if queued_job_id:
+            return queued_job_id
+        prune_push_jobs()
+        job_id = queued_job_id = str(uuid.uuid4())
+        started = time.time()
+        save_push_job(job_id, 'running', 'Push in progress', started)
+        PUSH_EXECUTOR.submit(run_push_job, job_id, started)
+    return job_id
+
+def count_pending_upload():
+    """Count a saved upload and start a background push once AUTO_PUSH_THRESHOLD is reached."""
+    global pending_uploads
+    if not AUTO_PUSH_THRESHOLD:
+        return
+    with PENDING_LOCK:
+        pending_uploads += 1
+        if pending_uploads < AUTO_PUSH_THRESHOLD:
+            return
+        pending_uploads = 0
+    logger.info("%d images uploaded, starting a background push.", AUTO_PUSH_THRESHOLD)
+    start_push_job()
+
 @app.route('/api/upload', methods=['POST'])
 def upload_image():
     """Endpoint to upload a single image."""
@@ -154,33 +609,24 @@ def upload_image():
             'message': 'No file part in the request'
         }), 400
     
-    file = request.files['file']
-    
-    if file.filename == '':
+    body, status_code = process_upload(request.files['file'])
+    return jsonify(body), status_code
+
+@app.route('/api/upload-raw', methods=['POST'])
+def upload_raw_image():
+    """Endpoint to upload a single image sent as the raw request body, named by the X-Filename header."""
+    filename = request.headers.get('X-Filename')
+    if not filename:
         return jsonify({
             'status': 'error',
-            'message': 'No file selected'
+            'message': 'Missing X-Filename header'
         }), 400
     
-    if file and allowed_file(file.filename):
-        new_filename = rename_and_save_image(file)
-        if new_filename:
-            return jsonify({
-                'status': 'success',
-                'url' : f'https://easyfarms-assets.pages.dev/images/{new_filename}',
-                'message': f'Image uploaded and saved as: {new_filename}',
-                'filename': new_filename
-            }), 200
-        else:
-            return jsonify({
-                'status': 'error',
-                'message': 'Error processing image. Invalid or corrupted file.'
-            }), 400
-    else:
-        return jsonify({
-            'status': 'error',
-            'message': 'Invalid file format. Allowed formats: png, jpg, jpeg, gif'
-        }), 400
+    # The body is streamed straight to disk, skipping multipart parsing
+    # and Werkzeug's temporary spool file
+    file = FileStorage(request.stream, filename=filename)
+    body, status_code = process_upload(file)
+    return jsonify(body), status_code
 
 @app.route('/api/batch-upload', methods=['POST'])
 def batch_upload_images():
@@ -191,56 +637,20 @@ def batch_upload_images():
             'message': 'No files part in the request'
         }), 400
     
-    files = request.files.getlist('files')
-    
-    if not files or all(file.filename == '' for file in files):
-        return jsonify({
-            'status': 'error',
-            'message': 'No files selected'
-        }), 400
-    
-    results = []
-    for file in files:
-        if file and allowed_file(file.filename):
-            new_filename = rename_and_save_image(file)
-            if new_filename:
-                results.append({
-                    'filename': file.filename,
-                    'url' : f'https://easyfarms-assets.pages.dev/images/{new_filename}',
-                    'new_filename': new_filename,
-                    'status': 'success',
-                    'message': f'Image saved as: {new_filename}'
-                })
-            else:
-                results.append({
-                    'filename': file.filename,
-                    'status': 'error',
-                    'message': 'Error processing image. Invalid or corrupted file.'
-                })
-        else:
-            results.append({
-                'filename': file.filename,
-                'status': 'error',
-                'message': 'Invalid file format. Allowed formats: png, jpg, jpeg, gif'
-            })
-    
-    if all(result['status'] == 'error' for result in results):
-        return jsonify({
-            'status': 'error',
-            'message': 'All uploads failed',
-            'results': results
-        }), 400
-    
-    status_code = 200 if any(result['status'] == 'success' for result in results) else 400
-    return jsonify({
-        'status': 'success' if status_code == 200 else 'partial_success',
-        'message': 'Batch upload processed',
-        'results': results
-    }), status_code
+    body, status_code = process_files(request.files.getlist('files'))
+    return jsonify(body), status_code
 
 @app.route('/api/trigger-push', methods=['POST'])
 def trigger_push():
-    """Endpoint to manually trigger GitHub push."""
+    """Endpoint to manually trigger GitHub push; pass ?background=1 to return immediately."""
+    if request.args.get('background') == '1':
+        job_id = start_push_job()
+        return jsonify({
+            'status': 'accepted',
+            'message': 'Push started in the background',
+            'job_id': job_id
+        }), 202
+    
     success, message = push_images_to_github()
     if success:
         return jsonify({
@@ -253,48 +663,46 @@ def trigger_push():
             'message': message
         }), 400
 
+@app.route('/api/push-status/<uuid:job_id>', methods=['GET'])
+def push_status(job_id):
+    """Endpoint to check on a background push."""
+    try:
+        with open(os.path.join(app.config['PUSH_JOBS_FOLDER'], f"{job_id}.json")) as f:
+            job = json.load(f)
+    except FileNotFoundError:
+        return jsonify({
+            'status': 'error',
+            'message': 'Unknown push job'
+        }), 404
+    
+    if job['status'] == 'running' and push_job_lost(job):
+        job['status'], job['message'] = 'lost', 'Push job stopped before it finished'
+    
+    return jsonify({
+        'status': job['status'],
+        'message': job['message'],
+        'job_id': str(job_id)
+    }), 200
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    """Return oversized uploads as a JSON error like the rest of the API."""
+    return jsonify({
+        'status': 'error',
+        'message': (f"Upload too large. Each request, including all files of a batch, "
+                    f"is limited to {app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)} MB in total")
+    }), 413
+
 # Optional: Web interface for testing
 @app.route('/', methods=['GET', 'POST'])
 def upload_page():
     """Render a simple upload page for testing."""
     if request.method == 'POST':
         if 'file' in request.files:
-            file = request.files['file']
-            if file and allowed_file(file.filename):
-                new_filename = rename_and_save_image(file)
-                if new_filename:
-                    return jsonify({
-                        'status': 'success',
-                        'message': f'Image uploaded and saved as: {new_filename}',
-                        'filename': new_filename
-                    }), 200
-                else:
-                    return jsonify({
-                        'status': 'error',
-                        'message': 'Error processing image.'
-                    }), 400
+            return upload_image()
         elif 'files' in request.files:
-            files = request.files.getlist('files')
-            results = []
-            for file in files:
-                if file and allowed_file(file.filename):
-                    new_filename = rename_and_save_image(file)
-                    if new_filename:
-                        results.append({
-                            'filename': file.filename,
-                            'new_filename': new_filename,
-                            'status': 'success'
-                        })
-                    else:
-                        results.append({
-                            'filename': file.filename,
-                            'status': 'error'
-                        })
-            return jsonify({
-                'status': 'success',
-                'results': results
-            }), 200
-    return render_template('upload.html')
+            return batch_upload_images()
+    return Response(UPLOAD_PAGE_HTML, mimetype='text/html', headers={'Cache-Control': 'public, max-age=3600'})
 
 if __name__ == '__main__':
     # Run locally for development